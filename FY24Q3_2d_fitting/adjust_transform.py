@@ -1,5 +1,7 @@
-from bundle_adjustment_2d import optimize_transformation, point_to_segment_distance
-from plot_results import plot_adjustments
+from bundle_adjustment_2d import optimize_transformation, create_constraint_store, calculate_transformation_matrix, closest_points_on_segments, closest_points_on_polylines
+from plot_results import plot_adjustments, plot_residual_heatmap
+from residual_report import summarize_residuals, create_residual_report, save_residual_report
+from pixel_to_crs import load_worldfile, save_worldfile, compose_worldfile
 import numpy as np
 import pandas as pd
 import argparse
@@ -42,14 +44,14 @@ def load_data_from_yaml(file_path):
 
 def extract_data_by_mode(data, modes):
     """
-    Extract points and segments based on specified modes.
+    Extract points, segments and polylines based on specified modes.
 
     Args:
-        data (dict): Input data containing points and segments.
+        data (dict): Input data containing points, segments and polylines.
         modes (list): List of modes to filter by.
 
     Returns:
-        tuple: Filtered points and segments.
+        tuple: Filtered points, segments and polylines.
     """
     filtered_points = {
         key: value for key, value in data.items()
@@ -59,48 +61,113 @@ def extract_data_by_mode(data, modes):
         key: value for key, value in data.items()
         if value['type'] == 'segment' and value['mode'] in modes
     }
-    return filtered_points, filtered_segments
+    filtered_polylines = {
+        key: value for key, value in data.items()
+        if value['type'] == 'polyline' and value['mode'] in modes
+    }
+    return filtered_points, filtered_segments, filtered_polylines
 
-def convert_data_for_optimization(points, segments):
+def convert_data_for_optimization(points, segments, polylines=None, dtype=np.float64, center=False, origin=None):
     """
     Convert extracted data into a format suitable for optimization.
 
     Args:
         points (dict): Filtered points data.
         segments (dict): Filtered segments data.
+        polylines (dict, optional): Filtered polylines data.
+        dtype (np.dtype): Storage type of the coordinates (e.g. np.float32).
+        center (bool): Store coordinates relative to their mean.
+        origin (array-like, optional): Offset subtracted from all coordinates instead of their mean.
 
     Returns:
-        tuple: Arrays for reference points, target points, segments, and target points on segments.
+        dict: Constraint store shared by optimization, residual calculation and plotting.
     """
-    optimize_reference_points = [np.array(value['reference_position']) for value in points.values()]
-    optimize_target_points = [np.array(value['target_position']) for value in points.values()]
+    polylines = polylines if polylines is not None else {}
+
+    return create_constraint_store(
+        [value['reference_position'] for value in points.values()],
+        [value['target_position'] for value in points.values()],
+        [
+            (value['reference_segment']['start'], value['reference_segment']['end'])
+            for value in segments.values()
+        ],
+        [value['target_points'] for value in segments.values()],
+        reference_polylines=[value['reference_polyline'] for value in polylines.values()],
+        target_points_on_polylines=[value['target_points'] for value in polylines.values()],
+        point_keys=points.keys(),
+        segment_keys=segments.keys(),
+        polyline_keys=polylines.keys(),
+        dtype=dtype,
+        center=center,
+        origin=origin
+    )
 
-    optimize_segments = [
-        (
-            np.array(value['reference_segment']['start']),
-            np.array(value['reference_segment']['end'])
-        )
-        for value in segments.values()
-    ]
-    optimize_target_points_on_segments = [
-        [np.array(point) for point in value['target_points']]
-        for value in segments.values()
-    ]
+def calculate_residual_vectors(store, translation, theta, scale):
+    """
+    Calculate residual vectors for points and segments.
+
+    Args:
+        store (dict): Constraint store from convert_data_for_optimization.
+        translation (np.ndarray): Translation vector.
+        theta (float): Rotation angle in radians.
+        scale (float): Scaling factor.
+
+    Returns:
+        tuple: Transformed target positions and residual vectors (reference minus transformed),
+            points first followed by target points on segments and on polylines.
+    """
+    transformation_matrix = calculate_transformation_matrix(theta, scale)
+
+    # Express the translation relative to the store origin
+    origin = store['origin']
+    local_translation = np.asarray(translation, dtype=np.float64) + transformation_matrix @ origin - origin
+
+    transformed_targets = store['target_points'] @ transformation_matrix.T + local_translation
+    point_vectors = store['reference_points'] - transformed_targets
+
+    transformed_segment_targets = store['segment_targets'] @ transformation_matrix.T + local_translation
+    segment_index = store['segment_index']
+    segment_vectors = closest_points_on_segments(
+        transformed_segment_targets,
+        store['reference_segments'][segment_index, 0],
+        store['reference_segments'][segment_index, 1]
+    ) - transformed_segment_targets
+
+    transformed_polyline_targets = store['polyline_targets'] @ transformation_matrix.T + local_translation
+    polyline_vectors = closest_points_on_polylines(store, transformed_polyline_targets) - transformed_polyline_targets
+
+    positions = np.vstack([transformed_targets, transformed_segment_targets, transformed_polyline_targets]) + origin
+    return positions, np.vstack([point_vectors, segment_vectors, polyline_vectors])
+
+def calculate_residual_arrays(store, translation, theta, scale):
+    """
+    Calculate residuals for points and segments as arrays.
+
+    Args:
+        store (dict): Constraint store from convert_data_for_optimization.
+        translation (np.ndarray): Translation vector.
+        theta (float): Rotation angle in radians.
+        scale (float): Scaling factor.
 
+    Returns:
+        tuple: Point residuals and residuals of target points on segments and on polylines.
+    """
+    _, residual_vectors = calculate_residual_vectors(store, translation, theta, scale)
+    residuals = np.linalg.norm(residual_vectors, axis=1)
+    num_points = len(store['target_points'])
+    num_segment_points = len(store['segment_targets'])
     return (
-        np.array(optimize_reference_points),
-        np.array(optimize_target_points),
-        optimize_segments,
-        optimize_target_points_on_segments
+        residuals[:num_points],
+        residuals[num_points:num_points + num_segment_points],
+        residuals[num_points + num_segment_points:]
     )
 
-def calculate_residuals(points, segments, translation, theta, scale):
+def calculate_residuals(store, translation, theta, scale):
     """
     Calculate residuals for points and segments.
 
     Args:
-        points (dict): Filtered points data.
-        segments (dict): Filtered segments data.
+        store (dict): Constraint store from convert_data_for_optimization.
         translation (np.ndarray): Translation vector.
         theta (float): Rotation angle in radians.
         scale (float): Scaling factor.
@@ -108,36 +175,36 @@ def calculate_residuals(points, segments, translation, theta, scale):
     Returns:
         dict: Residuals for points and segments.
     """
-    residual_dict = {}
+    return residual_arrays_to_dict(store, *calculate_residual_arrays(store, translation, theta, scale))
 
-    # Rotation matrix for transformation
-    rotation_matrix = np.array([
-        [np.cos(theta), -np.sin(theta)],
-        [np.sin(theta), np.cos(theta)]
-    ])
+def residual_arrays_to_dict(store, point_residuals, segment_residuals, polyline_residuals):
+    """
+    Key residual arrays by point name.
 
-    for key, value in points.items():
-        transformed_target = (
-            (np.array(value['target_position']) @ rotation_matrix.T) * scale + translation
-        )
-        residual = np.linalg.norm(transformed_target - np.array(value['reference_position']))
-        residual_dict[key] = round(residual, 4)
+    Args:
+        store (dict): Constraint store the residuals were calculated for.
+        point_residuals (np.ndarray): Point residuals.
+        segment_residuals (np.ndarray): Residuals of target points on segments.
+        polyline_residuals (np.ndarray): Residuals of target points on polylines.
 
-    for key, value in segments.items():
-        segment = (
-            np.array(value['reference_segment']['start']),
-            np.array(value['reference_segment']['end'])
-        )
-        for i, target_point in enumerate(value['target_points']):
-            transformed_target_point = (
-                (np.array(target_point) @ rotation_matrix.T) * scale + translation
-            )
-            residual = point_to_segment_distance(transformed_target_point, segment)
-            residual_dict[f"{key}_Point{i+1}"] = round(residual, 4)
+    Returns:
+        dict: Residuals rounded to 4 decimals, keyed by point name.
+    """
+    residual_dict = dict(zip(store['point_keys'], np.round(point_residuals, 4).tolist()))
+
+    segment_index = store['segment_index']
+    point_numbers = np.arange(len(segment_index)) - store['segment_offsets'][segment_index] + 1
+    for index, number, residual in zip(segment_index, point_numbers, np.round(segment_residuals, 4).tolist()):
+        residual_dict[f"{store['segment_keys'][index]}_Point{number}"] = residual
+
+    polyline_index = store['polyline_index']
+    point_numbers = np.arange(len(polyline_index)) - store['polyline_target_offsets'][polyline_index] + 1
+    for index, number, residual in zip(polyline_index, point_numbers, np.round(polyline_residuals, 4).tolist()):
+        residual_dict[f"{store['polyline_keys'][index]}_Point{number}"] = residual
 
     return residual_dict
 
-def display_results(translation, theta, scale, residual_dict, label="Results"):
+def display_results(translation, theta, scale, store, label="Results", max_rows=50):
     """
     Display optimization results and residuals.
 
@@ -145,14 +212,23 @@ def display_results(translation, theta, scale, residual_dict, label="Results"):
         translation (np.ndarray): Translation vector.
         theta (float): Rotation angle in radians.
         scale (float): Scaling factor.
-        residual_dict (dict): Residuals for points and segments.
+        store (dict): Constraint store the residuals are calculated for.
         label (str): Label for the parameter set (e.g., "Results").
+        max_rows (int): Print a summary instead of the per-point table above this many residuals.
     """
     theta_degrees = np.degrees(theta)
     print(f"{label} Translation (dx, dy):", translation)
     print(f"{label} Rotation (theta in degrees):", theta_degrees)
     print(f"{label} Scale:", scale)
 
+    residual_arrays = calculate_residual_arrays(store, translation, theta, scale)
+    residuals = np.concatenate(residual_arrays)
+    if len(residuals) > max_rows:
+        print(f"{label} Residual Summary:")
+        print(pd.Series(summarize_residuals(residuals)))
+        return
+
+    residual_dict = residual_arrays_to_dict(store, *residual_arrays)
     residuals_df = pd.DataFrame(list(residual_dict.items()), columns=["Point/Segment", "Residual"])
     residuals_df.loc["Mean"] = ["Mean", round(residuals_df["Residual"].mean(), 4)]
 
@@ -166,17 +242,37 @@ def main():
     parser = argparse.ArgumentParser(description="Run bundle adjustment with residual calculation.")
     parser.add_argument("yaml_file", type=str, help="Path to the YAML file containing input data.")
     parser.add_argument("--plot_result", action="store_true", help="Generate and display plots for the results.")
+    parser.add_argument("--float32", action="store_true", help="Store constraint coordinates as float32.")
+    parser.add_argument("--center", action="store_true", help="Store constraint coordinates relative to their mean (always applied with --float32).")
+    parser.add_argument("--origin", type=float, nargs=2, default=None, metavar=("X", "Y"), help="Store constraint coordinates relative to this origin instead of their mean.")
+    parser.add_argument("--report", type=str, default=None, help="Output prefix for the residual report of the full fit (writes PREFIX_summary.json and PREFIX_cells.csv).")
+    parser.add_argument("--cell_size", type=float, default=None, help="Grid cell size for the residual report (default: 1/50 of the data extent).")
+    parser.add_argument("--heatmap", action="store_true", help="Plot a heatmap of the binned residuals of the full fit (saved as PREFIX_heatmap.png with --report).")
+    parser.add_argument("--worldfile", type=str, default=None, help="Path to the world file used to convert the target pixels to CRS.")
+    parser.add_argument("--output_worldfile", type=str, default=None, help="Path to write the world file corrected by the full fit to (requires --worldfile).")
     args = parser.parse_args()
 
+    if args.output_worldfile is not None and args.worldfile is None:
+        parser.error("--output_worldfile requires --worldfile.")
+    if args.worldfile is not None and args.output_worldfile is None:
+        parser.error("--worldfile requires --output_worldfile.")
+    if args.cell_size is not None and args.cell_size <= 0:
+        parser.error("--cell_size must be positive.")
+
     # Load data from YAML
     data = load_data_from_yaml(args.yaml_file)
 
     # Extract optimization data
-    filtered_points, filtered_segments = extract_data_by_mode(data, modes=["optimize"])
+    filtered_points, filtered_segments, filtered_polylines = extract_data_by_mode(data, modes=["optimize"])
 
     # Convert data for optimization
-    optimize_reference_points, optimize_target_points, optimize_segments, optimize_target_points_on_segments = convert_data_for_optimization(
-        filtered_points, filtered_segments
+    store = convert_data_for_optimization(
+        filtered_points,
+        filtered_segments,
+        filtered_polylines,
+        dtype=np.float32 if args.float32 else np.float64,
+        center=args.center,
+        origin=args.origin
     )
 
     # Optimization scenarios
@@ -196,36 +292,19 @@ def main():
             translation = np.array([0.0, 0.0])
             theta = 0.0
             scale = 1.0
-            residuals = calculate_residuals(
-                filtered_points, filtered_segments, translation, theta, scale
-            )
         else:
             # Optimize for the given scenario
             translation, theta, scale = optimize_transformation(
-                optimize_reference_points,
-                optimize_target_points,
-                optimize_segments,
-                optimize_target_points_on_segments,
+                store,
                 optimize_translation=optimize_translation,
                 optimize_rotation=optimize_rotation,
                 optimize_scale=optimize_scale
             )
-            residuals = calculate_residuals(
-                filtered_points, filtered_segments, translation, theta, scale
-            )
+
+        display_results(translation, theta, scale, store, label=label)
 
         scenarios.append({
             "label": label,
-            "reference_points": {key: value['reference_position'] for key, value in filtered_points.items()},
-            "reference_segments": [
-                (value['reference_segment']['start'], value['reference_segment']['end'])
-                for value in filtered_segments.values()
-            ],
-            "target_points": {key: value['target_position'] for key, value in filtered_points.items()},
-            "target_points_on_segments": [
-                [np.array(point) for point in value['target_points']]
-                for value in filtered_segments.values()
-            ],
             "dx": translation[0],
             "dy": translation[1],
             "theta": theta,
@@ -233,27 +312,55 @@ def main():
             "color": color
         })
 
-    if args.plot_result:
-        plot_adjustments(
-            {key: value['reference_position'] for key, value in filtered_points.items()},
-            [
-                (value['reference_segment']['start'], value['reference_segment']['end'])
-                for value in filtered_segments.values()
-            ],
-            {key: value['target_position'] for key, value in filtered_points.items()},
-            [
-                [np.array(point) for point in value['target_points']]
-                for value in filtered_segments.values()
-            ],
-            [{
-                "dx": scenario['dx'],
-                "dy": scenario['dy'],
-                "theta": scenario['theta'],
-                "scale": scenario['scale'],
-                "label": scenario['label'],
-                "color": scenario['color']
-            } for scenario in scenarios]
+    if args.output_worldfile is not None:
+        # Compose the full fit with the world file so pixels map directly into the reference frame
+        full_fit = scenarios[-1]
+        corrected_params = compose_worldfile(
+            *load_worldfile(args.worldfile),
+            [full_fit['dx'], full_fit['dy']],
+            full_fit['theta'],
+            full_fit['scale']
         )
+        save_worldfile(args.output_worldfile, *corrected_params)
+        print(f"Corrected world file saved to {args.output_worldfile}")
+
+    if args.report is not None or args.heatmap:
+        # Report residuals of the full fit for every mode that takes part in the evaluation
+        full_fit = scenarios[-1]
+        residual_points, residual_segments, residual_polylines = extract_data_by_mode(data, modes=["residual"])
+        mode_stores = {
+            "optimize": store,
+            "residual": convert_data_for_optimization(
+                residual_points,
+                residual_segments,
+                residual_polylines,
+                dtype=np.float32 if args.float32 else np.float64,
+                center=args.center,
+                origin=args.origin
+            )
+        }
+        report = create_residual_report(
+            {
+                mode: calculate_residual_vectors(
+                    mode_store, [full_fit['dx'], full_fit['dy']], full_fit['theta'], full_fit['scale']
+                )
+                for mode, mode_store in mode_stores.items()
+            },
+            cell_size=args.cell_size
+        )
+
+        if args.report is not None:
+            for path in save_residual_report(report, args.report):
+                print(f"Residual report saved to {path}")
+        if args.heatmap:
+            plot_residual_heatmap(
+                report['cells'],
+                report['cell_size'],
+                output_path=f"{args.report}_heatmap.png" if args.report is not None else None
+            )
+
+    if args.plot_result:
+        plot_adjustments(store, scenarios)
 
 if __name__ == "__main__":
     main()
@@ -31,6 +31,223 @@ def point_to_segment_distance(point, segment):
         closest_point = p1 + projection * line_unitvec
     return np.linalg.norm(point - closest_point)
 
+def closest_points_on_segments(points, segment_starts, segment_ends):
+    """
+    Find the closest point on each segment to its corresponding point.
+
+    Args:
+        points (np.ndarray): Points of shape (N, 2).
+        segment_starts (np.ndarray): Start points of the segments, shape (N, 2).
+        segment_ends (np.ndarray): End points of the segments, shape (N, 2).
+
+    Returns:
+        np.ndarray: Closest points on the segments, shape (N, 2).
+    """
+    # Compute in float64 even when the store holds narrower coordinates
+    segment_starts = np.asarray(segment_starts, dtype=np.float64)
+    line_vecs = np.asarray(segment_ends, dtype=np.float64) - segment_starts
+    point_vecs = points - segment_starts
+    line_len_sq = np.einsum('ij,ij->i', line_vecs, line_vecs)
+    projection = np.divide(
+        np.einsum('ij,ij->i', point_vecs, line_vecs),
+        line_len_sq,
+        out=np.zeros(len(line_len_sq)),
+        where=line_len_sq > 0
+    )
+    return segment_starts + np.clip(projection, 0.0, 1.0)[:, None] * line_vecs
+
+def point_to_segment_distances(points, segment_starts, segment_ends):
+    """
+    Calculate the distances from points to their corresponding segments.
+
+    Args:
+        points (np.ndarray): Points of shape (N, 2).
+        segment_starts (np.ndarray): Start points of the segments, shape (N, 2).
+        segment_ends (np.ndarray): End points of the segments, shape (N, 2).
+
+    Returns:
+        np.ndarray: The shortest distance from each point to its segment, shape (N,).
+    """
+    closest_points = closest_points_on_segments(points, segment_starts, segment_ends)
+    return np.linalg.norm(points - closest_points, axis=1)
+
+def closest_points_on_polyline(points, edge_starts, edge_ends, edge_mins, edge_maxs, chunk_size=2**20):
+    """
+    Find the closest point on a polyline for each point.
+
+    Exact distances are only evaluated for edges whose bounding box is not farther
+    away than the edge with the nearest bounding box.
+
+    Args:
+        points (np.ndarray): Points of shape (N, 2).
+        edge_starts (np.ndarray): Start points of the polyline edges, shape (E, 2).
+        edge_ends (np.ndarray): End points of the polyline edges, shape (E, 2).
+        edge_mins (np.ndarray): Lower corners of the edge bounding boxes, shape (E, 2).
+        edge_maxs (np.ndarray): Upper corners of the edge bounding boxes, shape (E, 2).
+        chunk_size (int): Maximum number of point-edge pairs evaluated at once.
+
+    Returns:
+        np.ndarray: Closest points on the polyline, shape (N, 2).
+    """
+    closest_points = np.empty((len(points), 2))
+    points_per_chunk = max(chunk_size // max(len(edge_starts), 1), 1)
+
+    for chunk_start in range(0, len(points), points_per_chunk):
+        chunk = points[chunk_start:chunk_start + points_per_chunk]
+        num_points = len(chunk)
+
+        # Squared distance from each point to each edge bounding box is a lower bound of the edge distance
+        gaps = np.maximum(np.maximum(edge_mins - chunk[:, None], chunk[:, None] - edge_maxs), 0.0)
+        lower_bounds = np.einsum('ijk,ijk->ij', gaps, gaps)
+
+        # The edge with the nearest bounding box gives an upper bound
+        nearest_edges = np.argmin(lower_bounds, axis=1)
+        candidates = closest_points_on_segments(chunk, edge_starts[nearest_edges], edge_ends[nearest_edges])
+        upper_bounds = np.sum((chunk - candidates) ** 2, axis=1)
+
+        # Evaluate exact distances only for edges that can beat the upper bound
+        mask = lower_bounds <= upper_bounds[:, None]
+        mask[np.arange(num_points), nearest_edges] = True
+        point_idx, edge_idx = np.nonzero(mask)
+        pair_closest = closest_points_on_segments(chunk[point_idx], edge_starts[edge_idx], edge_ends[edge_idx])
+        pair_dist_sq = np.sum((chunk[point_idx] - pair_closest) ** 2, axis=1)
+
+        # Keep the nearest pair of each point
+        order = np.lexsort((pair_dist_sq, point_idx))
+        is_first = np.concatenate([[True], point_idx[order][1:] != point_idx[order][:-1]])
+        best = order[is_first]
+        closest_points[chunk_start + point_idx[best]] = pair_closest[best]
+
+    return closest_points
+
+def closest_points_on_polylines(store, points):
+    """
+    Find the closest point on the corresponding polyline for each target point on a polyline.
+
+    Args:
+        store (dict): Constraint store from create_constraint_store.
+        points (np.ndarray): Target points on polylines, shape (T, 2), ordered as polyline_targets.
+
+    Returns:
+        np.ndarray: Closest points on the polylines, shape (T, 2).
+    """
+    closest_points = np.empty((len(points), 2))
+    vertices = store['polyline_vertices']
+    vertex_offsets = store['polyline_vertex_offsets']
+    target_offsets = store['polyline_target_offsets']
+
+    for i in range(len(store['polyline_keys'])):
+        targets = slice(target_offsets[i], target_offsets[i + 1])
+        if target_offsets[i] == target_offsets[i + 1]:
+            continue
+        # Polyline i has one edge less than vertices, so its edges start at vertex_offsets[i] - i
+        polyline = vertices[vertex_offsets[i]:vertex_offsets[i + 1]]
+        edges = slice(vertex_offsets[i] - i, vertex_offsets[i + 1] - i - 1)
+        closest_points[targets] = closest_points_on_polyline(
+            points[targets],
+            polyline[:-1],
+            polyline[1:],
+            store['polyline_edge_mins'][edges],
+            store['polyline_edge_maxs'][edges]
+        )
+
+    return closest_points
+
+def create_constraint_store(reference_points, target_points, reference_segments, target_points_on_segments, reference_polylines=(), target_points_on_polylines=(), point_keys=None, segment_keys=None, polyline_keys=None, dtype=np.float64, center=False, origin=None):
+    """
+    Pack constraints into contiguous arrays shared by fitting, residuals and plotting.
+
+    Target points on segments are stored back to back; segment i owns the rows
+    segment_offsets[i]:segment_offsets[i + 1] of segment_targets. Polyline vertices
+    and target points on polylines are stored the same way.
+
+    Args:
+        reference_points (array-like): Reference points.
+        target_points (array-like): Target points.
+        reference_segments (array-like): Reference segments as (start, end) pairs.
+        target_points_on_segments (list): List of target points on each segment.
+        reference_polylines (list, optional): Vertices of each reference polyline.
+        target_points_on_polylines (list, optional): List of target points on each polyline.
+        point_keys (list, optional): Names of the points.
+        segment_keys (list, optional): Names of the segments.
+        polyline_keys (list, optional): Names of the polylines.
+        dtype (np.dtype): Storage type of the coordinates (e.g. np.float32).
+        center (bool): Store coordinates relative to their mean to keep precision with large CRS values.
+            Always applied when dtype is narrower than float64.
+        origin (array-like, optional): Offset subtracted from all coordinates instead of their mean.
+
+    Returns:
+        dict: Constraint store.
+    """
+    reference_points = np.asarray(reference_points, dtype=np.float64).reshape(-1, 2)
+    target_points = np.asarray(target_points, dtype=np.float64).reshape(-1, 2)
+    reference_segments = np.asarray(reference_segments, dtype=np.float64).reshape(-1, 2, 2)
+    counts = np.array([len(targets) for targets in target_points_on_segments], dtype=np.int64)
+    segment_targets = np.array(
+        [point for targets in target_points_on_segments for point in targets], dtype=np.float64
+    ).reshape(-1, 2)
+
+    vertex_counts = np.array([len(polyline) for polyline in reference_polylines], dtype=np.int64)
+    polyline_vertices = np.array(
+        [vertex for polyline in reference_polylines for vertex in polyline], dtype=np.float64
+    ).reshape(-1, 2)
+    polyline_counts = np.array([len(targets) for targets in target_points_on_polylines], dtype=np.int64)
+    polyline_targets = np.array(
+        [point for targets in target_points_on_polylines for point in targets], dtype=np.float64
+    ).reshape(-1, 2)
+
+    if len(counts) != len(reference_segments):
+        raise ValueError("Each reference segment requires a list of target points.")
+    if len(reference_points) != len(target_points):
+        raise ValueError("Reference and target points must have the same length.")
+    if len(polyline_counts) != len(vertex_counts):
+        raise ValueError("Each reference polyline requires a list of target points.")
+    if np.any(vertex_counts < 2):
+        raise ValueError("Each reference polyline requires at least two vertices.")
+
+    all_target_points = np.vstack([target_points, segment_targets, polyline_targets])
+    # Narrow storage types lose precision on large CRS values, so they are always stored relative to an origin
+    all_points = np.vstack([reference_points, reference_segments.reshape(-1, 2), polyline_vertices, all_target_points])
+    if origin is not None:
+        origin = np.asarray(origin, dtype=np.float64).reshape(2)
+    elif (center or np.dtype(dtype).itemsize < np.dtype(np.float64).itemsize) and len(all_points) > 0:
+        origin = np.mean(all_points, axis=0)
+    else:
+        origin = np.zeros(2)
+    target_centroid = np.mean(all_target_points, axis=0) - origin if len(all_target_points) > 0 else np.zeros(2)
+
+    reference_segments = (reference_segments - origin).astype(dtype)
+    segment_index = np.repeat(np.arange(len(counts)), counts)
+    polyline_vertices = (polyline_vertices - origin).astype(dtype)
+    vertex_offsets = np.concatenate([[0], np.cumsum(vertex_counts)])
+
+    # Bounding boxes of the edges, skipping the pairs that join consecutive polylines
+    is_edge = np.ones(max(len(polyline_vertices) - 1, 0), dtype=bool)
+    is_edge[vertex_offsets[1:-1] - 1] = False
+    edge_mins = np.minimum(polyline_vertices[:-1], polyline_vertices[1:])[is_edge]
+    edge_maxs = np.maximum(polyline_vertices[:-1], polyline_vertices[1:])[is_edge]
+
+    return {
+        "point_keys": list(point_keys) if point_keys is not None else [f"Point{i+1}" for i in range(len(reference_points))],
+        "segment_keys": list(segment_keys) if segment_keys is not None else [f"Segment{i+1}" for i in range(len(reference_segments))],
+        "polyline_keys": list(polyline_keys) if polyline_keys is not None else [f"Polyline{i+1}" for i in range(len(vertex_counts))],
+        "reference_points": (reference_points - origin).astype(dtype),
+        "target_points": (target_points - origin).astype(dtype),
+        "reference_segments": reference_segments,
+        "segment_targets": (segment_targets - origin).astype(dtype),
+        "segment_offsets": np.concatenate([[0], np.cumsum(counts)]),
+        "segment_index": segment_index,
+        "polyline_vertices": polyline_vertices,
+        "polyline_vertex_offsets": vertex_offsets,
+        "polyline_edge_mins": edge_mins,
+        "polyline_edge_maxs": edge_maxs,
+        "polyline_targets": (polyline_targets - origin).astype(dtype),
+        "polyline_target_offsets": np.concatenate([[0], np.cumsum(polyline_counts)]),
+        "polyline_index": np.repeat(np.arange(len(polyline_counts)), polyline_counts),
+        "target_centroid": target_centroid,
+        "origin": origin
+    }
+
 def calculate_transformation_matrix(theta, scale):
     """
     Precompute the transformation matrix for rotation and scaling.
@@ -66,16 +283,13 @@ def transform_points(points, transformation_matrix, centroid, dx, dy):
     transformed_points = (centered_points @ transformation_matrix.T) + centroid + np.array([dx, dy])
     return transformed_points
 
-def error_function(params, reference_points, target_points, reference_segments, target_points_on_segments, optimize_translation, optimize_rotation, optimize_scale, residuals=None):
+def error_function(params, store, optimize_translation, optimize_rotation, optimize_scale, residuals=None):
     """
     Calculate the total error between transformed target data and reference data.
 
     Args:
         params (np.ndarray): Transformation parameters (translation, rotation, scale).
-        reference_points (np.ndarray): Reference points.
-        target_points (np.ndarray): Target points.
-        reference_segments (list): List of reference line segments.
-        target_points_on_segments (list): List of target points on segments.
+        store (dict): Constraint store from create_constraint_store.
         optimize_translation (bool): Whether to optimize translation.
         optimize_rotation (bool): Whether to optimize rotation.
         optimize_scale (bool): Whether to optimize scaling.
@@ -88,16 +302,12 @@ def error_function(params, reference_points, target_points, reference_segments,
     dx, dy, theta, scale = 0.0, 0.0, 0.0, 1.0
 
     # Handle empty target points or segments gracefully
-    if len(target_points) == 0 and len(target_points_on_segments) == 0:
+    if len(store['target_points']) == 0 and len(store['segment_targets']) == 0 and len(store['polyline_targets']) == 0:
         if residuals is not None:
             residuals.extend([])
         return 0.0
 
-    # Compute centroid of all target points, including target points on segments
-    all_target_points = [target_points] if len(target_points) > 0 else []
-    all_target_points.extend(target_points_on_segments)
-    all_target_points = np.vstack(all_target_points) if all_target_points else np.array([[0.0, 0.0]])
-    target_centroid = np.mean(all_target_points, axis=0)
+    target_centroid = store['target_centroid']
 
     if optimize_translation:
         dx, dy = params[param_idx], params[param_idx + 1]
@@ -111,27 +321,33 @@ def error_function(params, reference_points, target_points, reference_segments,
     # Precompute transformation matrix
     transformation_matrix = calculate_transformation_matrix(theta, scale)
 
-    # Transform target points
-    transformed_target_points = transform_points(target_points, transformation_matrix, target_centroid, dx, dy) if len(target_points) > 0 else np.array([])
-
     # Compute point-to-point residuals
-    point_to_point_residuals = np.linalg.norm(reference_points - transformed_target_points, axis=1) if len(target_points) > 0 else []
-    point_to_point_error = np.sum(point_to_point_residuals ** 2) if len(target_points) > 0 else 0.0
+    transformed_target_points = transform_points(store['target_points'], transformation_matrix, target_centroid, dx, dy)
+    point_to_point_residuals = np.linalg.norm(store['reference_points'] - transformed_target_points, axis=1)
+    point_to_point_error = np.sum(point_to_point_residuals ** 2)
 
     # Compute point-to-segment residuals
-    point_to_segment_residuals = []
-    for segment, targets in zip(reference_segments, target_points_on_segments):
-        for target_point in targets:
-            transformed_target_point = transform_points(np.array([target_point]), transformation_matrix, target_centroid, dx, dy)[0]
-            dist = point_to_segment_distance(transformed_target_point, segment)
-            point_to_segment_residuals.append(dist)
-    point_to_segment_error = np.sum(np.array(point_to_segment_residuals) ** 2)
+    transformed_segment_targets = transform_points(store['segment_targets'], transformation_matrix, target_centroid, dx, dy)
+    segment_index = store['segment_index']
+    point_to_segment_residuals = point_to_segment_distances(
+        transformed_segment_targets,
+        store['reference_segments'][segment_index, 0],
+        store['reference_segments'][segment_index, 1]
+    )
+    point_to_segment_error = np.sum(point_to_segment_residuals ** 2)
+
+    # Compute point-to-polyline residuals
+    transformed_polyline_targets = transform_points(store['polyline_targets'], transformation_matrix, target_centroid, dx, dy)
+    closest_polyline_points = closest_points_on_polylines(store, transformed_polyline_targets)
+    point_to_polyline_residuals = np.linalg.norm(transformed_polyline_targets - closest_polyline_points, axis=1)
+    point_to_polyline_error = np.sum(point_to_polyline_residuals ** 2)
 
     if residuals is not None:
         residuals.extend(point_to_point_residuals)
         residuals.extend(point_to_segment_residuals)
+        residuals.extend(point_to_polyline_residuals)
 
-    return point_to_point_error + point_to_segment_error
+    return point_to_point_error + point_to_segment_error + point_to_polyline_error
 
 def create_initial_params(optimize_translation, optimize_rotation, optimize_scale):
     """
@@ -174,15 +390,12 @@ def adjust_to_original_frame(dx, dy, theta, scale, target_centroid):
     adjusted_dy = dy + centroid_adjustment[1]
     return [adjusted_dx, adjusted_dy], theta, scale
 
-def optimize_transformation(reference_points, target_points, reference_segments, target_points_on_segments, optimize_translation=True, optimize_rotation=True, optimize_scale=True):
+def optimize_transformation(store, optimize_translation=True, optimize_rotation=True, optimize_scale=True):
     """
     Optimize transformation parameters to align target data with reference data.
 
     Args:
-        reference_points (np.ndarray): Reference points.
-        target_points (np.ndarray): Target points.
-        reference_segments (list): List of reference line segments.
-        target_points_on_segments (list): List of target points on segments.
+        store (dict): Constraint store from create_constraint_store.
         optimize_translation (bool): Optimize translation.
         optimize_rotation (bool): Optimize rotation.
         optimize_scale (bool): Optimize scaling.
@@ -195,15 +408,10 @@ def optimize_transformation(reference_points, target_points, reference_segments,
     if len(initial_params) == 0:
         raise ValueError("No optimization parameters specified.")
 
-    all_target_points = [target_points] if len(target_points) > 0 else []
-    all_target_points.extend(target_points_on_segments)
-    all_target_points = np.vstack(all_target_points) if all_target_points else np.array([[0.0, 0.0]])
-    target_centroid = np.mean(all_target_points, axis=0)
-
     result = minimize(
         error_function,
         initial_params,
-        args=(reference_points, target_points, reference_segments, target_points_on_segments, optimize_translation, optimize_rotation, optimize_scale),
+        args=(store, optimize_translation, optimize_rotation, optimize_scale),
         method='BFGS'
     )
 
@@ -220,7 +428,8 @@ def optimize_transformation(reference_points, target_points, reference_segments,
     if optimize_scale:
         scale = optimal_params[params_index]
 
-    return adjust_to_original_frame(dx, dy, theta, scale, target_centroid)
+    # The store may be centered, so adjust around the centroid in the original coordinates
+    return adjust_to_original_frame(dx, dy, theta, scale, store['target_centroid'] + store['origin'])
 
 def main():
     """
@@ -255,12 +464,11 @@ def main():
         [np.array([3.0, 4.5]), np.array([3.2, 4.8])]
     ]
 
+    store = create_constraint_store(reference, target, reference_segments, target_points_on_segments)
+
     # Run optimization
     optimal_translation, optimal_theta, optimal_scale = optimize_transformation(
-        reference,
-        target,
-        reference_segments,
-        target_points_on_segments,
+        store,
         optimize_translation=args.optimize_translation,
         optimize_rotation=args.optimize_rotation,
         optimize_scale=args.optimize_scale
@@ -270,10 +478,7 @@ def main():
     residuals = []
     error_function(
         np.concatenate([optimal_translation, [optimal_theta, optimal_scale]]),
-        reference,
-        target,
-        reference_segments,
-        target_points_on_segments,
+        store,
         args.optimize_translation,
         args.optimize_rotation,
         args.optimize_scale,
@@ -1,6 +1,5 @@
 import pandas as pd
 import numpy as np
-from pyproj import CRS, Transformer
 import argparse
 
 # Function to load the world file and extract transformation parameters
@@ -26,14 +25,55 @@ def load_worldfile(worldfile_path):
 
     return a, b, c, d, e, f
 
+# Function to write transformation parameters to a world file
+def save_worldfile(worldfile_path, a, b, c, d, e, f):
+    """Write transformation parameters to a world file.
+
+    Args:
+        worldfile_path (str): Path to the world file.
+        a, b, c, d, e, f (float): World file parameters.
+    """
+    # World files store the coefficients in the order a, d, b, e, c, f
+    with open(worldfile_path, 'w') as file:
+        for value in (a, d, b, e, c, f):
+            file.write(f"{float(value)!r}\n")
+
+# Function to compose a fitted similarity transformation with world file parameters
+def compose_worldfile(a, b, c, d, e, f, translation, theta, scale):
+    """Compose world file parameters with a similarity transformation.
+
+    The similarity is applied after the world file, so the returned parameters
+    map pixel coordinates directly into the frame the similarity maps into.
+
+    Args:
+        a, b, c, d, e, f (float): World file parameters.
+        translation (array-like): Translation vector (dx, dy).
+        theta (float): Rotation angle in radians.
+        scale (float): Scaling factor.
+
+    Returns:
+        tuple: Composed parameters (a, b, c, d, e, f).
+    """
+    m00, m01 = scale * np.cos(theta), -scale * np.sin(theta)
+    m10, m11 = scale * np.sin(theta), scale * np.cos(theta)
+
+    composed_a = m00 * a + m01 * d
+    composed_b = m00 * b + m01 * e
+    composed_c = m00 * c + m01 * f + translation[0]
+    composed_d = m10 * a + m11 * d
+    composed_e = m10 * b + m11 * e
+    composed_f = m10 * c + m11 * f + translation[1]
+
+    return composed_a, composed_b, composed_c, composed_d, composed_e, composed_f
+
 # Function to transform pixel coordinates to CRS coordinates
 def pixel_to_crs(a, b, c, d, e, f, x_pixel, y_pixel):
     """Convert pixel coordinates to CRS coordinates.
 
     Args:
         a, b, c, d, e, f (float): World file parameters.
-        x_pixel (float): X coordinate in pixel space.
-        y_pixel (float): Y coordinate in pixel space.
+        x_pixel (float or np.ndarray): X coordinate(s) in pixel space.
+        y_pixel (float or np.ndarray): Y coordinate(s) in pixel space.
 
     Returns:
         tuple: CRS coordinates (x_crs, y_crs).
@@ -48,8 +88,8 @@ def crs_to_pixel(a, b, c, d, e, f, x_crs, y_crs):
 
     Args:
         a, b, c, d, e, f (float): World file parameters.
-        x_crs (float): X coordinate in CRS.
-        y_crs (float): Y coordinate in CRS.
+        x_crs (float or np.ndarray): X coordinate(s) in CRS.
+        y_crs (float or np.ndarray): Y coordinate(s) in CRS.
 
     Returns:
         tuple: Pixel coordinates (x_pixel, y_pixel).
@@ -77,6 +117,17 @@ def main():
         default="pixel_to_crs", 
         help="Mode of transformation (default: pixel_to_crs)."
     )
+    parser.add_argument(
+        "--translation",
+        type=float,
+        nargs=2,
+        default=None,
+        metavar=("DX", "DY"),
+        help="Fitted translation to compose with the world file (default: none)."
+    )
+    parser.add_argument("--theta", type=float, default=0.0, help="Fitted rotation in degrees (default: 0).")
+    parser.add_argument("--scale", type=float, default=1.0, help="Fitted scale (default: 1).")
+    parser.add_argument("--output_worldfile", default=None, help="Path to write the corrected world file to.")
 
     args = parser.parse_args()
 
@@ -84,32 +135,35 @@ def main():
     keypoints = pd.read_csv(args.csv)
     a, b, c, d, e, f = load_worldfile(args.worldfile)
 
+    # Compose the fitted similarity so the conversion needs a single pass
+    if args.translation is not None or args.theta != 0.0 or args.scale != 1.0:
+        translation = args.translation if args.translation is not None else [0.0, 0.0]
+        a, b, c, d, e, f = compose_worldfile(a, b, c, d, e, f, translation, np.radians(args.theta), args.scale)
+
+    if args.output_worldfile is not None:
+        save_worldfile(args.output_worldfile, a, b, c, d, e, f)
+        print(f"Corrected world file saved to {args.output_worldfile}")
+
     if args.mode == "pixel_to_crs":
         # Ensure CSV has the necessary columns
         if not {'x_pixel', 'y_pixel'}.issubset(keypoints.columns):
             raise ValueError("CSV file must contain 'x_pixel' and 'y_pixel' columns.")
 
-        # Transform pixel coordinates to CRS coordinates
-        crs_coords = keypoints.apply(
-            lambda row: pixel_to_crs(a, b, c, d, e, f, row['x_pixel'], row['y_pixel']), axis=1
+        # Transform pixel coordinates to CRS coordinates for all rows at once
+        keypoints['x_crs'], keypoints['y_crs'] = pixel_to_crs(
+            a, b, c, d, e, f, keypoints['x_pixel'].to_numpy(), keypoints['y_pixel'].to_numpy()
         )
 
-        # Split tuples into separate columns
-        keypoints[['x_crs', 'y_crs']] = pd.DataFrame(crs_coords.tolist(), index=keypoints.index)
-
     elif args.mode == "crs_to_pixel":
         # Ensure CSV has the necessary columns
         if not {'x_crs', 'y_crs'}.issubset(keypoints.columns):
             raise ValueError("CSV file must contain 'x_crs' and 'y_crs' columns.")
 
-        # Transform CRS coordinates to pixel coordinates
-        pixel_coords = keypoints.apply(
-            lambda row: crs_to_pixel(a, b, c, d, e, f, row['x_crs'], row['y_crs']), axis=1
+        # Transform CRS coordinates to pixel coordinates for all rows at once
+        keypoints['x_pixel'], keypoints['y_pixel'] = crs_to_pixel(
+            a, b, c, d, e, f, keypoints['x_crs'].to_numpy(), keypoints['y_crs'].to_numpy()
         )
 
-        # Split tuples into separate columns
-        keypoints[['x_pixel', 'y_pixel']] = pd.DataFrame(pixel_coords.tolist(), index=keypoints.index)
-
     # Overwrite the input CSV
     keypoints.to_csv(args.csv, index=False)
     print(f"Updated keypoints saved to {args.csv}")
@@ -1,63 +1,72 @@
 import matplotlib.pyplot as plt
+from matplotlib.collections import PolyCollection
 import numpy as np
+from bundle_adjustment_2d import create_constraint_store, calculate_transformation_matrix
 
-def plot_adjustments(reference_points, reference_segments, target_points, target_points_on_segments, dx_dy_theta_scale_labels):
+def plot_adjustments(store, dx_dy_theta_scale_labels):
     """
     Plot reference points, reference segments, target points, target points on segments, and adjusted points for multiple scenarios.
 
     Args:
-        reference_points (dict): Reference points with their positions.
-        reference_segments (list): Reference segments as tuples of start and end points.
-        target_points (dict): Original target points with their positions.
-        target_points_on_segments (list): List of target points corresponding to segments.
+        store (dict): Constraint store holding the reference and target data.
         dx_dy_theta_scale_labels (list): List of dictionaries containing dx, dy, theta, scale, labels, and colors.
     """
     plt.figure(figsize=(12, 8))
 
+    origin = store['origin']
+    reference_points = store['reference_points'] + origin
+    reference_segments = store['reference_segments'] + origin
+    target_points = store['target_points'] + origin
+    segment_targets = store['segment_targets'] + origin
+    segment_index = store['segment_index']
+    point_numbers = np.arange(len(segment_index)) - store['segment_offsets'][segment_index] + 1
+    polyline_vertices = store['polyline_vertices'] + origin
+    vertex_offsets = store['polyline_vertex_offsets']
+    polyline_targets = store['polyline_targets'] + origin
+    polyline_index = store['polyline_index']
+    polyline_point_numbers = np.arange(len(polyline_index)) - store['polyline_target_offsets'][polyline_index] + 1
+
     # Plot reference points
-    for key, pos in reference_points.items():
-        plt.scatter(pos[0], pos[1], color='red', marker='o', label='Reference Points' if key == list(reference_points.keys())[0] else "")
+    if len(reference_points) > 0:
+        plt.scatter(reference_points[:, 0], reference_points[:, 1], color='red', marker='o', label='Reference Points')
+    for key, pos in zip(store['point_keys'], reference_points):
         plt.text(pos[0] + 0.1, pos[1], key, color='red', fontsize=5)
 
     # Plot reference segments
-    for start, end in reference_segments:
-        plt.plot([start[0], end[0]], [start[1], end[1]], color='red', linestyle='-', label='Reference Segments' if start is reference_segments[0][0] else "")
+    for i, (start, end) in enumerate(reference_segments):
+        plt.plot([start[0], end[0]], [start[1], end[1]], color='red', linestyle='-', label='Reference Segments' if i == 0 else "")
+
+    # Plot reference polylines
+    for i in range(len(vertex_offsets) - 1):
+        polyline = polyline_vertices[vertex_offsets[i]:vertex_offsets[i + 1]]
+        plt.plot(polyline[:, 0], polyline[:, 1], color='red', linestyle='--', label='Reference Polylines' if i == 0 else "")
 
     # Apply transformations and plot adjusted points for each scenario
     for scenario in dx_dy_theta_scale_labels:
-        dx = scenario['dx']
-        dy = scenario['dy']
-        theta = scenario['theta']
-        scale = scenario['scale']
+        transformation_matrix = calculate_transformation_matrix(scenario['theta'], scenario['scale'])
+        translation = np.array([scenario['dx'], scenario['dy']])
         label = scenario['label']
         color = scenario['color']
 
-        # Compute rotation matrix
-        rotation_matrix = np.array([
-            [np.cos(theta), -np.sin(theta)],
-            [np.sin(theta), np.cos(theta)]
-        ])
-
-        # Transform target points
-        adjusted_points = {
-            key: (scale * (np.array(pos) @ rotation_matrix.T) + np.array([dx, dy]))
-            for key, pos in target_points.items()
-        }
-
-        # Transform target points on segments
-        adjusted_points_on_segments = [
-            [scale * (np.array(pos) @ rotation_matrix.T) + np.array([dx, dy]) for pos in segment]
-            for segment in target_points_on_segments
-        ]
-
-        for key, pos in adjusted_points.items():
-            plt.scatter(pos[0], pos[1], color=color, marker='o', label=f'{label} Adjusted Points' if key == list(adjusted_points.keys())[0] else "", alpha=0.7)
+        # Transform target points and target points on segments
+        adjusted_points = target_points @ transformation_matrix.T + translation
+        adjusted_points_on_segments = segment_targets @ transformation_matrix.T + translation
+
+        if len(adjusted_points) > 0:
+            plt.scatter(adjusted_points[:, 0], adjusted_points[:, 1], color=color, marker='o', label=f'{label} Adjusted Points', alpha=0.7)
+        for key, pos in zip(store['point_keys'], adjusted_points):
             plt.text(pos[0] + 0.1, pos[1], key, fontsize=5)
 
-        for i, segment_points in enumerate(adjusted_points_on_segments):
-            for j, pos in enumerate(segment_points):
-                plt.scatter(pos[0], pos[1], color=color, marker='d', label=f'{label} Adjusted Points on Segments' if i == 0 and j == 0 else "", alpha=0.7)
-                plt.text(pos[0] + 0.1, pos[1], f"S{i+1}_P{j+1}", fontsize=5)
+        if len(adjusted_points_on_segments) > 0:
+            plt.scatter(adjusted_points_on_segments[:, 0], adjusted_points_on_segments[:, 1], color=color, marker='d', label=f'{label} Adjusted Points on Segments', alpha=0.7)
+        for i, j, pos in zip(segment_index, point_numbers, adjusted_points_on_segments):
+            plt.text(pos[0] + 0.1, pos[1], f"S{i+1}_P{j}", fontsize=5)
+
+        adjusted_points_on_polylines = polyline_targets @ transformation_matrix.T + translation
+        if len(adjusted_points_on_polylines) > 0:
+            plt.scatter(adjusted_points_on_polylines[:, 0], adjusted_points_on_polylines[:, 1], color=color, marker='^', label=f'{label} Adjusted Points on Polylines', alpha=0.7)
+        for i, j, pos in zip(polyline_index, polyline_point_numbers, adjusted_points_on_polylines):
+            plt.text(pos[0] + 0.1, pos[1], f"L{i+1}_P{j}", fontsize=5)
 
     plt.title("Adjusted Points Across Scenarios", fontsize=16)
     plt.xlabel("X Coordinate", fontsize=14)
@@ -68,6 +77,57 @@ def plot_adjustments(reference_points, reference_segments, target_points, target
     plt.tight_layout()
     plt.show()
 
+def plot_residual_heatmap(cells, cell_size, output_path=None):
+    """
+    Plot the RMS residual per grid cell with the mean residual vector of each cell.
+
+    Args:
+        cells (pd.DataFrame): Grid cells from residual_report.bin_residuals.
+        cell_size (float): Edge length of the grid cells.
+        output_path (str, optional): Path to save the figure to instead of displaying it.
+    """
+    if len(cells) == 0:
+        print("No residuals to plot.")
+        return
+
+    cell_x = cells['cell_x'].to_numpy()
+    cell_y = cells['cell_y'].to_numpy()
+
+    # Draw one square per non-empty cell so memory scales with the data, not the grid extent
+    x_min = cell_x * cell_size
+    y_min = cell_y * cell_size
+    squares = np.stack([
+        np.column_stack([x_min, y_min]),
+        np.column_stack([x_min + cell_size, y_min]),
+        np.column_stack([x_min + cell_size, y_min + cell_size]),
+        np.column_stack([x_min, y_min + cell_size])
+    ], axis=1)
+    collection = PolyCollection(squares, array=cells['rms'].to_numpy(), cmap='viridis', edgecolors='none')
+
+    plt.figure(figsize=(12, 8))
+    plt.gca().add_collection(collection)
+    plt.gca().autoscale_view()
+    plt.colorbar(collection, label="RMS Residual")
+    plt.quiver(
+        (cell_x + 0.5) * cell_size,
+        (cell_y + 0.5) * cell_size,
+        cells['mean_dx'].to_numpy(),
+        cells['mean_dy'].to_numpy(),
+        color='white'
+    )
+
+    plt.title("Binned Residuals", fontsize=16)
+    plt.xlabel("X Coordinate", fontsize=14)
+    plt.ylabel("Y Coordinate", fontsize=14)
+    plt.gca().set_aspect('equal', adjustable='box')  # Ensure equal scaling
+    plt.tight_layout()
+    if output_path is not None:
+        plt.savefig(output_path, dpi=150)
+        plt.close()
+        print(f"Residual heatmap saved to {output_path}")
+    else:
+        plt.show()
+
 # Example usage
 if __name__ == "__main__":
     reference_points_example = {
@@ -95,10 +155,12 @@ if __name__ == "__main__":
         {"dx": -0.2, "dy": 0.3, "theta": np.radians(-5), "scale": 0.9, "label": "Scenario 2", "color": "green"}
     ]
 
-    plot_adjustments(
-        reference_points_example,
+    store_example = create_constraint_store(
+        list(reference_points_example.values()),
+        list(target_points_example.values()),
         reference_segments_example,
-        target_points_example,
         target_points_on_segments_example,
-        dx_dy_theta_scale_labels_example
+        point_keys=reference_points_example.keys()
     )
+
+    plot_adjustments(store_example, dx_dy_theta_scale_labels_example)
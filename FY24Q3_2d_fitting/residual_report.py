@@ -0,0 +1,132 @@
+import json
+import numpy as np
+import pandas as pd
+
+def summarize_residuals(residuals, percentiles=(50, 90, 95, 99)):
+    """
+    Summarize residual magnitudes.
+
+    Args:
+        residuals (array-like): Residual magnitudes.
+        percentiles (tuple): Percentiles to include.
+
+    Returns:
+        dict: Count, mean, RMS, max and percentiles of the residuals.
+    """
+    residuals = np.asarray(residuals, dtype=np.float64)
+    summary = {"count": int(len(residuals))}
+    if len(residuals) == 0:
+        return summary
+
+    summary["mean"] = float(np.mean(residuals))
+    summary["rms"] = float(np.sqrt(np.mean(residuals ** 2)))
+    summary["max"] = float(np.max(residuals))
+    for percentile, value in zip(percentiles, np.percentile(residuals, percentiles)):
+        summary[f"p{percentile}"] = float(value)
+    return summary
+
+def bin_residuals(positions, vectors, cell_size):
+    """
+    Aggregate residual vectors on a regular grid.
+
+    Cells are aligned to multiples of cell_size, so grids from different runs line up.
+
+    Args:
+        positions (np.ndarray): Positions of the residuals, shape (N, 2).
+        vectors (np.ndarray): Residual vectors, shape (N, 2).
+        cell_size (float): Edge length of the grid cells.
+
+    Returns:
+        pd.DataFrame: One row per non-empty cell with count, mean, RMS, max and mean residual vector.
+    """
+    if cell_size <= 0:
+        raise ValueError("Cell size must be positive.")
+
+    columns = ["cell_x", "cell_y", "x_min", "y_min", "count", "mean", "rms", "max", "mean_dx", "mean_dy"]
+    positions = np.asarray(positions, dtype=np.float64).reshape(-1, 2)
+    vectors = np.asarray(vectors, dtype=np.float64).reshape(-1, 2)
+    if len(positions) == 0:
+        return pd.DataFrame(columns=columns)
+
+    cells = np.floor(positions / cell_size).astype(np.int64)
+    unique_cells, inverse = np.unique(cells, axis=0, return_inverse=True)
+    inverse = inverse.ravel()
+    num_cells = len(unique_cells)
+    magnitudes = np.linalg.norm(vectors, axis=1)
+
+    counts = np.bincount(inverse, minlength=num_cells)
+    sums = np.bincount(inverse, weights=magnitudes, minlength=num_cells)
+    squared_sums = np.bincount(inverse, weights=magnitudes ** 2, minlength=num_cells)
+    dx_sums = np.bincount(inverse, weights=vectors[:, 0], minlength=num_cells)
+    dy_sums = np.bincount(inverse, weights=vectors[:, 1], minlength=num_cells)
+
+    # Maximum per cell from residuals sorted by cell
+    order = np.argsort(inverse, kind='stable')
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    maxima = np.maximum.reduceat(magnitudes[order], starts)
+
+    return pd.DataFrame({
+        "cell_x": unique_cells[:, 0],
+        "cell_y": unique_cells[:, 1],
+        "x_min": unique_cells[:, 0] * cell_size,
+        "y_min": unique_cells[:, 1] * cell_size,
+        "count": counts,
+        "mean": sums / counts,
+        "rms": np.sqrt(squared_sums / counts),
+        "max": maxima,
+        "mean_dx": dx_sums / counts,
+        "mean_dy": dy_sums / counts
+    }, columns=columns)
+
+def create_residual_report(mode_results, cell_size=None, percentiles=(50, 90, 95, 99), cells_per_side=50):
+    """
+    Create a residual report with per-mode summaries and binned spatial statistics.
+
+    Args:
+        mode_results (dict): Mapping of mode to (positions, residual vectors).
+        cell_size (float, optional): Edge length of the grid cells. Defaults to the
+            larger data extent divided by cells_per_side.
+        percentiles (tuple): Percentiles to include in the summaries.
+        cells_per_side (int): Number of cells along the larger extent when cell_size is not given.
+
+    Returns:
+        dict: Cell size, summaries per mode (and "all"), and a DataFrame of grid cells.
+    """
+    positions = np.vstack([np.reshape(result[0], (-1, 2)) for result in mode_results.values()] + [np.empty((0, 2))])
+    vectors = np.vstack([np.reshape(result[1], (-1, 2)) for result in mode_results.values()] + [np.empty((0, 2))])
+
+    if cell_size is None:
+        extent = np.ptp(positions, axis=0).max() if len(positions) > 0 else 0.0
+        cell_size = float(extent / cells_per_side) if extent > 0 else 1.0
+
+    summary = {
+        mode: summarize_residuals(np.linalg.norm(np.reshape(result[1], (-1, 2)), axis=1), percentiles)
+        for mode, result in mode_results.items()
+    }
+    summary["all"] = summarize_residuals(np.linalg.norm(vectors, axis=1), percentiles)
+
+    return {
+        "cell_size": cell_size,
+        "summary": summary,
+        "cells": bin_residuals(positions, vectors, cell_size)
+    }
+
+def save_residual_report(report, output_prefix):
+    """
+    Save a residual report as a JSON summary and a CSV of grid cells.
+
+    Args:
+        report (dict): Report from create_residual_report.
+        output_prefix (str): Prefix of the output files.
+
+    Returns:
+        list: Paths of the written files.
+    """
+    summary_path = f"{output_prefix}_summary.json"
+    cells_path = f"{output_prefix}_cells.csv"
+
+    with open(summary_path, 'w') as f:
+        json.dump({"cell_size": report["cell_size"], "summary": report["summary"]}, f, indent=2)
+    report["cells"].to_csv(cells_path, index=False)
+
+    return [summary_path, cells_path]
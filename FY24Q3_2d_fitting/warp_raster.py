@@ -0,0 +1,306 @@
+import os
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from pixel_to_crs import load_worldfile, save_worldfile, compose_worldfile, pixel_to_crs, crs_to_pixel
+import argparse
+
+# Function to open a raster as a memory-mapped array
+def open_raster(raster_path, mode='r', shape=None, dtype=None):
+    """Open a NumPy (.npy) or raw raster as a memory-mapped array.
+
+    Args:
+        raster_path (str): Path to the raster file.
+        mode (str): Memory-map mode ('r', 'r+' or 'w+').
+        shape (tuple, optional): Raster shape, required for raw rasters and when creating.
+        dtype (str, optional): Raster data type, required for raw rasters and when creating.
+
+    Returns:
+        np.memmap: Memory-mapped raster of shape (height, width) or (height, width, bands).
+    """
+    if raster_path.endswith('.npy'):
+        if mode == 'w+':
+            return np.lib.format.open_memmap(raster_path, mode='w+', dtype=dtype, shape=tuple(shape))
+        return np.load(raster_path, mmap_mode=mode)
+
+    if shape is None or dtype is None:
+        raise ValueError("Raw rasters require both shape and dtype.")
+    return np.memmap(raster_path, dtype=dtype, mode=mode, shape=tuple(shape))
+
+# Function to check that the nodata value fits the raster data type
+def check_nodata(nodata, dtype):
+    """Check that a nodata value can be stored in a raster data type.
+
+    Args:
+        nodata (float): Value for output pixels outside the source raster.
+        dtype (np.dtype): Data type of the output raster.
+
+    Raises:
+        ValueError: If the value is NaN or out of range for an integer data type.
+    """
+    dtype = np.dtype(dtype)
+    if not np.issubdtype(dtype, np.integer):
+        return
+    if np.isnan(nodata):
+        raise ValueError(f"Nodata value NaN cannot be stored in a {dtype} raster.")
+    info = np.iinfo(dtype)
+    if not info.min <= nodata <= info.max:
+        raise ValueError(f"Nodata value {nodata} is outside the range of a {dtype} raster ({info.min} to {info.max}).")
+
+# Function to compute the north-up output grid covering the warped raster
+def compute_output_grid(source_shape, source_params, pixel_size=None):
+    """Compute the output raster shape and world file parameters.
+
+    Args:
+        source_shape (tuple): Shape of the source raster.
+        source_params (tuple): Parameters (a, b, c, d, e, f) mapping source pixels to the output frame.
+        pixel_size (float, optional): Output pixel size. Defaults to the source pixel size
+            in the output frame.
+
+    Returns:
+        tuple: Output shape (height, width) and world file parameters (a, b, c, d, e, f).
+    """
+    a, b, c, d, e, f = source_params
+    height, width = source_shape[:2]
+
+    # World file coordinates refer to pixel centers, so the footprint extends half a pixel beyond them
+    corners_x = np.array([-0.5, width - 0.5, -0.5, width - 0.5])
+    corners_y = np.array([-0.5, -0.5, height - 0.5, height - 0.5])
+    x_crs, y_crs = pixel_to_crs(a, b, c, d, e, f, corners_x, corners_y)
+
+    if pixel_size is None:
+        pixel_size = np.sqrt(abs(a * e - b * d))
+    if pixel_size <= 0:
+        raise ValueError("Output pixel size must be positive.")
+
+    # Tolerate floating-point error so an exact fit does not gain or lose a pixel
+    output_width = max(int(np.ceil((x_crs.max() - x_crs.min()) / pixel_size - 1e-9)), 1)
+    output_height = max(int(np.ceil((y_crs.max() - y_crs.min()) / pixel_size - 1e-9)), 1)
+
+    # Output world file parameters refer to the center of the upper left output pixel
+    return (output_height, output_width), (
+        pixel_size, 0.0, x_crs.min() + pixel_size / 2, 0.0, -pixel_size, y_crs.max() - pixel_size / 2
+    )
+
+# Function to sample a source window at fractional pixel positions
+def sample_window(window, x_pixel, y_pixel, interpolation):
+    """Sample a raster window with nearest or bilinear interpolation.
+
+    Args:
+        window (np.ndarray): Source pixels, shape (height, width) or (height, width, bands).
+            May be a memory map, in which case only the sampled pixels are read.
+        x_pixel (np.ndarray): X coordinates in window pixel space.
+        y_pixel (np.ndarray): Y coordinates in window pixel space.
+        interpolation (str): "nearest" or "bilinear".
+
+    Returns:
+        np.ndarray: Sampled values, one row per coordinate.
+    """
+    height, width = window.shape[:2]
+
+    if interpolation == "nearest":
+        x_index = np.clip(np.rint(x_pixel).astype(np.intp), 0, width - 1)
+        y_index = np.clip(np.rint(y_pixel).astype(np.intp), 0, height - 1)
+        return window[y_index, x_index]
+
+    if interpolation != "bilinear":
+        raise ValueError(f"Unsupported interpolation: {interpolation}.")
+
+    x0 = np.clip(np.floor(x_pixel).astype(np.intp), 0, max(width - 2, 0))
+    y0 = np.clip(np.floor(y_pixel).astype(np.intp), 0, max(height - 2, 0))
+    x1 = np.minimum(x0 + 1, width - 1)
+    y1 = np.minimum(y0 + 1, height - 1)
+    wx = np.clip(x_pixel - x0, 0.0, 1.0)
+    wy = np.clip(y_pixel - y0, 0.0, 1.0)
+    if window.ndim == 3:
+        wx = wx[:, None]
+        wy = wy[:, None]
+
+    top = window[y0, x0] * (1.0 - wx) + window[y0, x1] * wx
+    bottom = window[y1, x0] * (1.0 - wx) + window[y1, x1] * wx
+    return top * (1.0 - wy) + bottom * wy
+
+# Function to warp a single output tile
+def warp_tile(source_spec, destination_spec, source_params, destination_params, tile, interpolation, nodata, max_window_pixels=2**24):
+    """Resample one output tile from the source raster.
+
+    Rasters are reopened from their specs so the function can run in a process pool.
+    Nearest sampling reads only the sampled pixels from the memory map. Bilinear sampling
+    reads the source window covering the tile when it has at most max_window_pixels pixels,
+    and otherwise gathers the four neighbours of each sample from the memory map.
+
+    Args:
+        source_spec (dict): Source raster path, shape and dtype.
+        destination_spec (dict): Destination raster path, shape and dtype.
+        source_params (tuple): Parameters (a, b, c, d, e, f) mapping source pixels to the output frame.
+        destination_params (tuple): World file parameters of the destination raster.
+        tile (tuple): Output window (row_start, row_stop, col_start, col_stop).
+        interpolation (str): "nearest" or "bilinear".
+        nodata (float): Value for output pixels outside the source raster.
+        max_window_pixels (int): Largest source window read in one piece for bilinear sampling.
+    """
+    source = open_raster(source_spec['path'], 'r', source_spec['shape'], source_spec['dtype'])
+    destination = open_raster(destination_spec['path'], 'r+', destination_spec['shape'], destination_spec['dtype'])
+    row_start, row_stop, col_start, col_stop = tile
+    height, width = source.shape[:2]
+
+    # Map output pixel centers back to source pixel coordinates
+    cols, rows = np.meshgrid(
+        np.arange(col_start, col_stop, dtype=float),
+        np.arange(row_start, row_stop, dtype=float)
+    )
+    x_crs, y_crs = pixel_to_crs(*destination_params, cols, rows)
+    x_pixel, y_pixel = crs_to_pixel(*source_params, x_crs, y_crs)
+
+    valid = (x_pixel > -0.5) & (x_pixel < width - 0.5) & (y_pixel > -0.5) & (y_pixel < height - 0.5)
+    output = np.full((row_stop - row_start, col_stop - col_start) + source.shape[2:], nodata, dtype=source.dtype)
+
+    if np.any(valid):
+        x_pixel = x_pixel[valid]
+        y_pixel = y_pixel[valid]
+
+        # Source window covering this tile
+        x_min = max(int(np.floor(x_pixel.min())), 0)
+        x_max = min(int(np.floor(x_pixel.max())) + 2, width)
+        y_min = max(int(np.floor(y_pixel.min())), 0)
+        y_max = min(int(np.floor(y_pixel.max())) + 2, height)
+
+        if interpolation == "nearest" or (y_max - y_min) * (x_max - x_min) > max_window_pixels:
+            # Gather the sampled pixels straight from the memory map, bounded by the tile size
+            values = sample_window(source, x_pixel, y_pixel, interpolation)
+        else:
+            window = np.asarray(source[y_min:y_max, x_min:x_max], dtype=float)
+            values = sample_window(window, x_pixel - x_min, y_pixel - y_min, interpolation)
+
+        if interpolation == "bilinear" and np.issubdtype(source.dtype, np.integer):
+            info = np.iinfo(source.dtype)
+            values = np.clip(np.rint(values), info.min, info.max)
+        output[valid] = values
+
+    destination[row_start:row_stop, col_start:col_stop] = output
+    destination.flush()
+
+def warp_raster(source_path, source_worldfile, destination_path, translation=(0.0, 0.0), theta=0.0, scale=1.0,
+                interpolation="bilinear", tile_size=512, workers=None, use_processes=False, nodata=0,
+                pixel_size=None, source_shape=None, source_dtype=None, destination_worldfile=None,
+                max_window_pixels=2**24):
+    """
+    Resample a raster into the reference frame of a fitted similarity transformation.
+
+    Args:
+        source_path (str): Path to the source raster (.npy or raw).
+        source_worldfile (str): Path to the world file of the source raster.
+        destination_path (str): Path to the output raster (.npy or raw).
+        translation (array-like): Translation vector from optimize_transformation.
+        theta (float): Rotation angle in radians from optimize_transformation.
+        scale (float): Scaling factor from optimize_transformation.
+        interpolation (str): "nearest" or "bilinear".
+        tile_size (int): Edge length of the output tiles in pixels.
+        workers (int, optional): Number of pool workers.
+        use_processes (bool): Use a process pool instead of a thread pool.
+        nodata (float): Value for output pixels outside the source raster.
+        pixel_size (float, optional): Output pixel size in reference units.
+        source_shape (tuple, optional): Shape of a raw source raster.
+        source_dtype (str, optional): Data type of a raw source raster.
+        destination_worldfile (str, optional): Path of the output world file.
+            Defaults to the output raster path with a .wld extension.
+        max_window_pixels (int): Largest source window a worker reads in one piece; larger
+            windows are sampled pixel by pixel from the memory map so memory stays bounded.
+
+    Returns:
+        tuple: Output shape and world file parameters (a, b, c, d, e, f).
+
+    Raises:
+        ValueError: If the nodata value cannot be stored in the raster data type.
+    """
+    if tile_size <= 0:
+        raise ValueError("Tile size must be positive.")
+
+    source = open_raster(source_path, 'r', source_shape, source_dtype)
+    source_spec = {'path': source_path, 'shape': source.shape, 'dtype': source.dtype.str}
+    check_nodata(nodata, source.dtype)
+
+    source_params = compose_worldfile(*load_worldfile(source_worldfile), translation, theta, scale)
+    output_size, destination_params = compute_output_grid(source.shape, source_params, pixel_size)
+    destination_shape = output_size + source.shape[2:]
+    del source
+
+    destination = open_raster(destination_path, 'w+', destination_shape, source_spec['dtype'])
+    destination_spec = {'path': destination_path, 'shape': destination.shape, 'dtype': destination.dtype.str}
+    destination.flush()
+    del destination
+
+    tiles = [
+        (row, min(row + tile_size, output_size[0]), col, min(col + tile_size, output_size[1]))
+        for row in range(0, output_size[0], tile_size)
+        for col in range(0, output_size[1], tile_size)
+    ]
+
+    executor_class = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+    with executor_class(max_workers=workers) as executor:
+        futures = [
+            executor.submit(
+                warp_tile, source_spec, destination_spec, source_params, destination_params,
+                tile, interpolation, nodata, max_window_pixels
+            )
+            for tile in tiles
+        ]
+        for future in futures:
+            future.result()
+
+    if destination_worldfile is None:
+        destination_worldfile = os.path.splitext(destination_path)[0] + ".wld"
+    save_worldfile(destination_worldfile, *destination_params)
+
+    return destination_shape, destination_params
+
+def main():
+    """
+    Main entry point for warping a raster with fitted transformation parameters.
+    """
+    parser = argparse.ArgumentParser(description="Resample a raster into the reference frame using fitted transformation parameters.")
+    parser.add_argument("raster", type=str, help="Path to the source raster (.npy or raw).")
+    parser.add_argument("worldfile", type=str, help="Path to the world file of the source raster.")
+    parser.add_argument("output", type=str, help="Path to the output raster (.npy or raw).")
+    parser.add_argument("--translation", type=float, nargs=2, default=[0.0, 0.0], metavar=("DX", "DY"), help="Fitted translation (default: 0 0).")
+    parser.add_argument("--theta", type=float, default=0.0, help="Fitted rotation in degrees (default: 0).")
+    parser.add_argument("--scale", type=float, default=1.0, help="Fitted scale (default: 1).")
+    parser.add_argument("--interpolation", choices=["nearest", "bilinear"], default="bilinear", help="Interpolation method (default: bilinear).")
+    parser.add_argument("--tile_size", type=int, default=512, help="Output tile size in pixels (default: 512).")
+    parser.add_argument("--workers", type=int, default=None, help="Number of pool workers (default: executor default).")
+    parser.add_argument("--processes", action="store_true", help="Use a process pool instead of a thread pool.")
+    parser.add_argument("--nodata", type=float, default=0, help="Value for pixels outside the source raster (default: 0).")
+    parser.add_argument("--pixel_size", type=float, default=None, help="Output pixel size (default: source pixel size).")
+    parser.add_argument("--shape", type=int, nargs='+', default=None, help="Shape of a raw source raster (height width [bands]).")
+    parser.add_argument("--dtype", type=str, default=None, help="Data type of a raw source raster (e.g. uint8).")
+    parser.add_argument("--output_worldfile", type=str, default=None, help="Path of the output world file (default: output path with .wld).")
+    args = parser.parse_args()
+
+    # Reject a nodata value the raster cannot hold before any output is written
+    try:
+        check_nodata(args.nodata, open_raster(args.raster, 'r', args.shape, args.dtype).dtype)
+    except ValueError as error:
+        parser.error(str(error))
+
+    output_shape, output_params = warp_raster(
+        args.raster,
+        args.worldfile,
+        args.output,
+        translation=args.translation,
+        theta=np.radians(args.theta),
+        scale=args.scale,
+        interpolation=args.interpolation,
+        tile_size=args.tile_size,
+        workers=args.workers,
+        use_processes=args.processes,
+        nodata=args.nodata,
+        pixel_size=args.pixel_size,
+        source_shape=args.shape,
+        source_dtype=args.dtype,
+        destination_worldfile=args.output_worldfile
+    )
+
+    print(f"Warped raster of shape {output_shape} saved to {args.output}")
+    print("Output world file parameters (a, b, c, d, e, f):", output_params)
+
+if __name__ == "__main__":
+    main()